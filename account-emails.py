@@ -45,94 +45,98 @@ def main(argv):
     termwidth = console.termwidth()
   entries = collections.defaultdict(list)
 
-  # Create all possible combinations of dots in the username.
-  # (Only considers single dots between letters, not multiple.)
-  basenames = collections.defaultdict(lambda: 0)
   # How many places are there for dots in-between characters in the email?
   places = len(args.email)-1
   if 2**places > args.max_output:
     fail('Error: Length of email {!r} would give more than --max-output combinations ({} > {})'
          .format(args.email, 2**places, args.max_output))
-  # Make a format string like '{:05b}' that will print a binary sequence of 1's and 0's as wide as
-  # the number of places.
-  format_str = '{:0'+str(places)+'b}'
-  # The number of possible dot combinations is 2**places.
-  for i in range(2**places):
-    email = ''
-    # Get a string of 0's and 1's representing presence or absence of dots.
-    pattern = format_str.format(i)
-    # Build an email string with dots where there are 0's in the pattern string.
-    for char, bit in zip(args.email, pattern):
-      if bit == '0':
-        email += char
-      elif bit == '1':
-        email += char + '.'
-    email += args.email[-1]
-    basenames[email] = 0
-
-  # Read accounts.txt file.
+  # Create all possible combinations of dots in the username.
+  # (Only considers single dots between letters, not multiple.)
+  basenames = dict.fromkeys(get_dot_combinations(args.email), 0)
+
   relays = collections.defaultdict(list)
-  with open(args.accounts_path, 'rU') as accounts_file:
-    for entry in accountslib.parse(accounts_file):
-      for account in entry.accounts.values():
-        for section in account.values():
-          for key, values in section.items():
-            if key.lower() == 'email':
-              for value in values:
-                username, *rest = value.value.split('@')
-                if len(rest) == 1:
-                  domain = rest[0]
-                elif len(rest) == 0:
-                  domain = None
-                elif len(rest) > 1:
-                  raise ValueError(f'Invalid email {value.value!r}')
-                basename = username.split('+')[0]
-                if basename.replace('.', '') == args.email:
-                  if args.collapse_dots:
-                    basename = collapse_dots(basename)
-                  basenames[basename] += 1
-                  entries[basename].append(entry.name)
-                elif args.relay and domain == 'relay.firefox.com':
-                  relays[value.value].append(entry.name)
-
-  # Print all the used combinations.
-  least_used = None
-  uses_min = 999999999
-  dots_min = len(args.email)
-  basename_list = reversed(sorted(basenames.keys(), key=lambda basename: basenames[basename]))
-  for basename in basename_list:
-    if args.choose:
-      # Track the email with the fewest uses, and if there are multiple with the fewest, find the
-      # one out of those with the fewest dots.
-      uses = basenames[basename]
-      dots = len(basename) - len(args.email)
-      if uses < uses_min:
-        least_used = basename
-        uses_min = uses
-        dots_min = dots
-      elif uses == uses_min:
-        if dots < dots_min:
-          least_used = basename
-          dots_min = dots
-    else:
-      # If not --choose, just print every email.
-      print_email(basename, basenames[basename], entries[basename], args.tabs, termwidth)
+  # Read accounts.txt file, all in one go (text mode already translates universal newlines).
+  with open(args.accounts_path) as accounts_file:
+    lines = accounts_file.read().split('\n')
+  for entry_name, email in iter_emails(accountslib.parse(lines)):
+    username, at, domain = email.partition('@')
+    if not at:
+      domain = None
+    elif '@' in domain:
+      raise ValueError(f'Invalid email {email!r}')
+    basename = username.split('+')[0]
+    dotted = match_dots(basename, args.email, collapse=args.collapse_dots)
+    if dotted is not None:
+      # (Addresses with leading, trailing, or repeated dots won't be in the dict yet.)
+      basenames[dotted] = basenames.get(dotted, 0) + 1
+      entries[dotted].append(entry_name)
+    elif args.relay and domain == 'relay.firefox.com':
+      relays[email].append(entry_name)
+
   if args.choose:
-    print_email(least_used, uses_min, entries[least_used], args.tabs, termwidth)
+    # Find the email with the fewest uses, and if there are multiple with the fewest, the one out
+    # of those with the fewest dots. This only needs a single pass, not a sort.
+    # (Ties are broken in favor of the last one added, same as the order the full listing uses.)
+    least_used = min(
+      reversed(basenames), key=lambda basename: (basenames[basename], len(basename)-len(args.email))
+    )
+    print_email(least_used, basenames[least_used], entries[least_used], args.tabs, termwidth)
   else:
+    # Print all the used combinations.
+    # Most-used first. Ties are listed in reverse of the order they were added.
+    basename_list = sorted(reversed(basenames.items()), key=lambda item: item[1], reverse=True)
+    for basename, uses in basename_list:
+      print_email(basename, uses, entries[basename], args.tabs, termwidth)
     for relay, entries in relays.items():
       username, domain = relay.split('@')
       domain_abbrev = domain.split('.')[0]
       print_email(f'{username}@{domain_abbrev}', len(entries), entries, args.tabs, termwidth)
 
 
-def collapse_dots(dotted_str):
-  collapsed_str = dotted_str
-  last_str = None
-  while collapsed_str != last_str:
-    last_str = collapsed_str
-    collapsed_str = collapsed_str.replace('..', '.')
-  return collapsed_str
+def iter_emails(entries):
+  """Yield an (entry name, email address) tuple for every "email" value in every account section of
+  every entry."""
+  for entry in entries:
+    for account in entry.accounts.values():
+      for section in account.values():
+        for key, values in section.items():
+          if key.lower() == 'email':
+            for value in values:
+              yield entry.name, value.value
+
+
+def get_dot_combinations(email):
+  """Return every way of putting single dots between the characters of `email`.
+  Each place gets either nothing or a dot, so there are 2**(len(email)-1) combinations. They're
+  built up a character at a time so every combination shares the work done on its prefix."""
+  combinations = [email[:1]]
+  for char in email[1:]:
+    combinations = [prefix+dot+char for prefix in combinations for dot in ('', '.')]
+  return combinations
+
+
+def match_dots(basename, target, collapse=True):
+  """Check whether `basename` is a dot-variation of `target` (ignoring dots, they're identical).
+  If so, return `basename`, with runs of consecutive dots collapsed into one if `collapse`.
+  Otherwise, return `None`."""
+  if len(basename) < len(target):
+    return None
+  chars = []
+  i = 0
+  last_char = None
+  for char in basename:
+    if char == '.':
+      if not (collapse and last_char == '.'):
+        chars.append(char)
+    elif i < len(target) and char == target[i]:
+      chars.append(char)
+      i += 1
+    else:
+      return None
+    last_char = char
+  if i != len(target):
+    return None
+  return ''.join(chars)
 
 
 def print_email(email, uses, entries, tabs=False, width=80):
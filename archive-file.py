@@ -2,9 +2,11 @@
 import os
 import sys
 import time
+import bisect
 import shutil
 import logging
 import argparse
+import itertools
 import datetime
 assert sys.version_info.major >= 3, 'Python 3 required'
 
@@ -19,6 +21,7 @@ PERIODS = {
   'yearly': int(60*60*24*365.2425),
   'forever':NOW-1,
 }
+ORDERED_PERIODS = tuple(period for period, age in sorted(PERIODS.items(), key=lambda i: i[1]))
 DESCRIPTION = """Archive copies of the target file. Keep a set of copies from different time
 periods, like the last hour, day, week, month, etc."""
 
@@ -153,18 +156,18 @@ def read_tracker(tracker_file, periods=PERIODS, expected_version=VERSION):
   """
   version = None
   tracker = {}
-  section = {}
+  records = []
   path = None
-  for line_raw in tracker_file:
-    # What kind of line is it?
-    header = line_raw.startswith('>')
-    section_header = not line_raw.startswith('\t')
+  # The file is small, so read it all at once.
+  for line_raw in tracker_file.read().split('\n'):
     line = line_raw.strip()
     # Ignore empty lines.
     if not line:
       continue
+    # What kind of line is it?
+    first_char = line_raw[0]
     # Check version in header.
-    if header:
+    if first_char == '>':
       if line.startswith('>version='):
         version = float(line[9:])
         if version > expected_version or expected_version - version >= 1.0:
@@ -172,12 +175,12 @@ def read_tracker(tracker_file, periods=PERIODS, expected_version=VERSION):
                '{}'.format(version, expected_version))
       continue
     # Start a new section.
-    if section_header:
+    if first_char != '\t':
       if not version:
         fail('Error: no version specified in tracker file.')
-      if section and path:
-        tracker[path] = section
-      section = {}
+      if records and path:
+        tracker[path] = build_section(records)
+      records = []
       path = line
     else:
       # Parse a data line.
@@ -202,19 +205,29 @@ def read_tracker(tracker_file, periods=PERIODS, expected_version=VERSION):
         fail('Error in tracker file. Invalid copy number {!r} on line\n{}'.format(copy, line))
       if copy > 2000:
         fail('Error in tracker file. Copy too large ({}) on line\n{}'.format(copy, line))
-      # Place the record for this line in the list for the period, at a location according to its
-      # copy number.
-      copies = section.get(period, [])
-      while len(copies) < copy:
-        copies.append(None)
-      copies[copy-1] = {'timestamp':timestamp, 'file':filename}
-      section[period] = copies
+      elif copy < 1:
+        fail('Error in tracker file. Invalid copy number {!r} on line\n{}'.format(copy, line))
+      records.append((period, copy, {'timestamp':timestamp, 'file':filename}))
   # Save the last section.
-  if section and path:
-    tracker[path] = section
+  if records and path:
+    tracker[path] = build_section(records)
   return tracker
 
 
+def build_section(records):
+  """Turn a list of (period, copy, archive) records into a tracker section.
+  Each record is placed in the list for its period, at a location according to its copy number.
+  Each list is allocated once, at the size of the largest copy number for that period."""
+  max_copies = {}
+  for period, copy, archive in records:
+    if copy > max_copies.get(period, 0):
+      max_copies[period] = copy
+  section = {period:[None]*max_copy for period, max_copy in max_copies.items()}
+  for period, copy, archive in records:
+    section[period][copy-1] = archive
+  return section
+
+
 def get_plan(tracker_section, destination, required_copies, periods=PERIODS, now=NOW):
   """Determine the changes needed to update the archives.
   Returns:
@@ -225,11 +238,22 @@ def get_plan(tracker_section, destination, required_copies, periods=PERIODS, now
   new_tracker_section = {}
   wanted = []
   all_archives = []
+  seen = set()
   # Pool all existing archives.
   for period in periods:
     for archive in tracker_section.get(period, []):
-      if archive not in all_archives:
+      if archive is None:
+        continue
+      key = (archive['timestamp'], archive['file'])
+      if key not in seen:
+        seen.add(key)
         all_archives.append(archive)
+  # Sort them by age so the ones in each time slot can be found with a binary search.
+  all_archives.sort(key=lambda archive: archive['timestamp'])
+  timestamps = [archive['timestamp'] for archive in all_archives]
+  # List the destination directory once instead of checking each archive file separately.
+  # If it can't be listed, fall back to checking each file.
+  existing_files = get_existing_files(destination)
   for period in get_ordered_periods(periods):
     copies = []
     # Iterate through each time period, finding which archives are now within that period.
@@ -240,19 +264,23 @@ def get_plan(tracker_section, destination, required_copies, periods=PERIODS, now
       slot_end_age = slot_start_age + period_length
       slot_end = now - slot_start_age
       slot_start = now - slot_end_age
+      # Find the archives that fall within the time period.
+      start_index = bisect.bisect_right(timestamps, slot_start)
+      end_index = bisect.bisect_right(timestamps, slot_end)
       candidates = []
-      for archive in all_archives:
-        # Check that the archive falls within the time period.
-        if archive is not None and slot_start < archive['timestamp'] <= slot_end:
-          # Check that the archive's file exists.
-          path = os.path.join(destination, archive['file'])
-          if os.path.isfile(path):
-            candidates.append(archive)
-          else:
-            logging.warning('{} archive is missing (file {!r}).'.format(period, path))
+      for archive in all_archives[start_index:end_index]:
+        # Check that the archive's file exists.
+        path = os.path.join(destination, archive['file'])
+        if existing_files is None:
+          exists = os.path.isfile(path)
+        else:
+          exists = archive['file'] in existing_files
+        if exists:
+          candidates.append(archive)
+        else:
+          logging.warning('{} archive is missing (file {!r}).'.format(period, path))
       if candidates:
-        # Choose the oldest archive, if there are multiple.
-        candidates.sort(key=lambda archive: archive['timestamp'])
+        # Choose the oldest archive, if there are multiple (they're already sorted by age).
         copies.append(candidates[0].copy())
       else:
         logging.debug('No existing archive can serve as {} copy {}.'.format(period, i+1))
@@ -267,6 +295,16 @@ def get_plan(tracker_section, destination, required_copies, periods=PERIODS, now
   return new_tracker_section, wanted
 
 
+def get_existing_files(destination):
+  """Return the set of names of the files in the `destination` directory.
+  Returns None if it can't be listed (the files may still be accessible)."""
+  try:
+    with os.scandir(destination or os.curdir) as entries:
+      return {entry.name for entry in entries if entry.is_file()}
+  except OSError:
+    return None
+
+
 def get_archive_path(target_path, destination, ext=None, now=NOW):
   filename = os.path.basename(target_path)
   if ext is None:
@@ -303,12 +341,8 @@ def get_files_to_delete(tracker_section, new_tracker_section):
 
 
 def get_files_in_tracker_section(tracker_section):
-  files = set()
-  for period, copies in tracker_section.items():
-    for archive in copies:
-      if archive is not None:
-        files.add(archive['file'])
-  return files
+  archives = itertools.chain.from_iterable(tracker_section.values())
+  return {archive['file'] for archive in archives if archive is not None}
 
 
 def delete_files(files_to_delete, destination):
@@ -327,6 +361,9 @@ def delete_files(files_to_delete, destination):
 
 
 def get_ordered_periods(periods=PERIODS):
+  # The default periods never change, so they're only sorted once.
+  if periods is PERIODS:
+    return ORDERED_PERIODS
   ordered_periods = []
   for period, age in sorted(periods.items(), key=lambda i: i[1]):
     ordered_periods.append(period)
@@ -335,16 +372,18 @@ def get_ordered_periods(periods=PERIODS):
 
 def write_tracker(tracker, tracker_path, periods=PERIODS, version=VERSION):
   ordered_periods = get_ordered_periods(periods)
+  # Build the whole file in memory and write it all at once.
+  lines = ['>version={}\n'.format(version)]
+  for path, section in tracker.items():
+    lines.append(path+'\n')
+    for period in ordered_periods:
+      copies = section.get(period, [])
+      for i, archive in enumerate(copies):
+        if archive is not None:
+          lines.append(f'\t{period}\t{i+1}\t{archive["timestamp"]}\t{archive["file"]}\n')
   try:
     with open(tracker_path, 'w') as tracker_file:
-      tracker_file.write('>version={}\n'.format(version))
-      for path, section in tracker.items():
-        tracker_file.write(path+'\n')
-        for period in ordered_periods:
-          copies = section.get(period, [])
-          for i, archive in enumerate(copies):
-            if archive is not None:
-              tracker_file.write('\t{}\t{}\t{timestamp}\t{file}\n'.format(period, i+1, **archive))
+      tracker_file.write(''.join(lines))
   except IOError:
     fail('Could not open file {!r}'.format(tracker_path))
 
@@ -9,9 +9,21 @@ import sys
 assert sys.version_info.major >= 3, 'Python 3 required'
 
 DESCRIPTION = """Read battery stats from upower and format into one line for a log entry."""
-SECTION_LINE_RE = r'^  ([^ ].*[^ ]):?$'
-INFO_LINE_RE = r'([^ ][^:]*): +([^ ].*)$'
-HISTORY_LINE_RE = r'^    (\d{10})\t'
+# One pattern for every kind of line in the upower output. Exactly one alternative matches each
+# valid line, so which groups are set tells you the type of line. upower output is ASCII, so \d
+# doesn't need to match any other digits.
+LINE_RE = re.compile(
+  r'^(?:  (?P<meta_key>[^ ][^:]*): +(?P<meta_value>[^ ].*)'  # metadata
+  r'|  (?P<section>[^ ].*[^ ]):?'                             # heading
+  r'|    (?P<data_key>[^ ][^:]*): +(?P<data_value>[^ ].*)'   # data
+  r'|    (?P<history>\d{10})\t.*'                             # history
+  r'|)$',                                                     # blank
+  re.ASCII
+)
+MONTHS = {
+  'Jan':1, 'Feb':2, 'Mar':3, 'Apr':4, 'May':5, 'Jun':6, 'Jul':7, 'Aug':8, 'Sep':9, 'Oct':10,
+  'Nov':11, 'Dec':12
+}
 TIME_UNITS = {'seconds':1, 'minutes':60, 'hours':60*60, 'days':24*60*60}
 COLUMNS = (
   {'key':('root','updated'), 'type':'timestamp'},
@@ -59,7 +71,7 @@ def main(argv):
     device = get_device()
     logging.info(f'Info: Found battery device: {device!r}')
 
-  data = info_to_dict(parse_info(run_command('upower', '--show-info', device)))
+  data = parse_info(run_command('upower', '--show-info', device))
   columns = get_output_columns(data)
   print(*columns, sep='\t')
 
@@ -77,48 +89,46 @@ def get_device():
 
 
 def parse_info(lines):
+  """Parse the output of `upower --show-info` into a dict mapping (section, key) to value."""
+  data = {}
+  section = 'root'
   for line in lines:
     type_, line_section, key, value = parse_line(line)
     if line_section is not None:
       section = line_section
     if type_ in ('heading', 'history'):
       continue
-    yield section, key, value
+    data[(section, key)] = value
+  return data
 
 
 def parse_line(line):
-  if match := re.search(r'^  '+INFO_LINE_RE, line):
+  match = LINE_RE.match(line)
+  if match is None:
+    raise ValueError(f'Unrecognized line: {line!r}')
+  if match['meta_key'] is not None:
     type_ = 'metadata'
     section = 'root'
-    key = match.group(1)
-    value = match.group(2)
-  elif match := re.search(SECTION_LINE_RE, line):
+    key = match['meta_key']
+    value = match['meta_value']
+  elif match['section'] is not None:
     type_ = 'heading'
-    section = match.group(1)
+    section = match['section']
     key = None
     value = None
-  elif match := re.search(r'^    '+INFO_LINE_RE, line):
+  elif match['data_key'] is not None:
     type_ = 'data'
     section = None
-    key = match.group(1)
-    value = match.group(2)
-  elif match := re.search(HISTORY_LINE_RE, line) or line == '':
+    key = match['data_key']
+    value = match['data_value']
+  else:
     type_ = 'history'
     section = None
     key = None
     value = None
-  else:
-    raise ValueError(f'Unrecognized line: {line!r}')
   return type_, section, key, value
 
 
-def info_to_dict(data_iter):
-  data_dict = {}
-  for section, key, value in data_iter:
-    data_dict[(section, key)] = value
-  return data_dict
-
-
 def get_output_columns(data):
   output = []
   for column in COLUMNS:
@@ -131,8 +141,7 @@ def get_output_columns(data):
       if isinstance(type_, type):
         value = type_(raw_value)
       else:
-        parser_name = 'parse_'+type_
-        parser = globals()[parser_name]
+        parser = PARSERS[type_]
         args = column.get('args', ())
         value = parser(raw_value, *args)
     output.append(value)
@@ -148,11 +157,10 @@ def parse_unit(unit_str, unit):
 
 def parse_time(time_str):
   """Parse an amount of time like '11.7 minutes' into a number of seconds (int)."""
-  fields = time_str.split()
-  if len(fields) != 2:
-    raise ValueError(f'Invalid time string: {time_str!r} has {len(fields)} fields instead of 2.')
-  value = float(fields[0])
-  unit = fields[1]
+  value_str, space, unit = time_str.rpartition(' ')
+  if not space:
+    raise ValueError(f'Invalid time string: {time_str!r} has no space between value and unit.')
+  value = float(value_str)
   try:
     multiplier = TIME_UNITS[unit]
   except KeyError:
@@ -161,11 +169,31 @@ def parse_time(time_str):
 
 
 def parse_timestamp(ts_str):
-  ts_trimmed = re.sub(r' \(\d+ .* ago\)$', '', ts_str)
-  dt = datetime.datetime.strptime(ts_trimmed, '%a %d %b %Y %I:%M:%S %p %Z')
+  """Parse a timestamp like 'Thu 15 Oct 2026 03:04:05 PM EDT (12 seconds ago)' into a unix
+  timestamp (int). Like strptime() with '%a %d %b %Y %I:%M:%S %p %Z', the time is interpreted as
+  local time, but this avoids re-parsing the format string on every call."""
+  ts_trimmed = ts_str.split(' (', 1)[0]
+  fields = ts_trimmed.split()
+  if len(fields) != 7:
+    raise ValueError(f'Invalid timestamp: {ts_str!r} has {len(fields)} fields instead of 7.')
+  weekday, day, month_str, year, time_str, meridian, timezone = fields
+  try:
+    month = MONTHS[month_str]
+  except KeyError:
+    raise ValueError(f'Invalid timestamp: unrecognized month {month_str!r}')
+  hour, minute, second = map(int, time_str.split(':'))
+  if meridian not in ('AM', 'PM') or not 1 <= hour <= 12:
+    raise ValueError(f'Invalid timestamp: invalid 12-hour time {time_str!r} {meridian!r}')
+  hour = hour % 12
+  if meridian == 'PM':
+    hour += 12
+  dt = datetime.datetime(int(year), month, int(day), hour, minute, second)
   return round(dt.timestamp())
 
 
+PARSERS = {'timestamp':parse_timestamp, 'unit':parse_unit, 'time':parse_time}
+
+
 def run_command(*command):
   logging.info(f'Info: Running $ {" ".join(command)}')
   result = subprocess.run(command, encoding='utf8', stdout=subprocess.PIPE)
@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 import argparse
+import concurrent.futures
+import functools
 import logging
 import pathlib
 import subprocess
 import sys
 import tempfile
 import typing
-import bs4
+import lxml.etree
+import lxml.html
 import requests
+import requests.adapters
 import yaml
+try:
+  import requests_cache
+except ImportError:
+  requests_cache = None
+# Use the libyaml-backed C loader, if PyYAML was built with it.
+try:
+  from yaml import CSafeLoader as YamlLoader
+except ImportError:
+  from yaml import SafeLoader as YamlLoader
 
 # GET https://cathedral.org/calendar/?filters[modality]=in-person&filters[date]=&filters[types][0]=sightseeing-tours&query=&current_page=2
 
 DOMAIN = 'cathedral.org'
 CALENDAR_PATH = '/calendar/'
+# The most pages to request at once.
+MAX_PAGE_THREADS = 4
 USER_AGENT = 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:108.0.1) Gecko/20100101 Firefox/108.0.1'
 ZENITY_CMD = [
   'zenity', '--list', '--title', 'National Cathedral Events', '--width', '750', '--height', '300',
@@ -33,9 +48,20 @@ HTML_FIELDS = {
   'location': {'tag':'span', 'class':'event_list_item_detail_label'},
   'tickets': {'tag':'span', 'class':'event_list_item_tickets_link_label'}
 }
+# An XPath to find descendant `tag` elements with `class_` as one of their classes (like
+# BeautifulSoup's `find_all(tag, class_=class_)`).
+CLASS_XPATH = ".//{tag}[contains(concat(' ', normalize-space(@class), ' '), ' {class_} ')]"
+DAY_XPATH = lxml.etree.XPath(CLASS_XPATH.format(tag='div', class_='event_list_row'))
+EVENT_XPATH = lxml.etree.XPath(CLASS_XPATH.format(tag='li', class_='event_list_item'))
+FIELD_XPATHS = {
+  field:lxml.etree.XPath(CLASS_XPATH.format(tag=spec['tag'], class_=spec['class']))
+  for field, spec in HTML_FIELDS.items()
+}
 SCRIPT_DIR = pathlib.Path(__file__).resolve().parent
 DEFAULT_FILTER_FILE = SCRIPT_DIR / 'cathedral-filters.yml'
-SILENCE_FILE = pathlib.Path('~/.local/share/nbsdata/SILENCE').expanduser()
+HOME = pathlib.Path.home()
+SILENCE_FILE = HOME / '.local/share/nbsdata/SILENCE'
+CACHE_FILE = HOME / '.cache/cathedral-scraper.sqlite'
 DESCRIPTION = """Check upcoming events at the National Cathedral and show ones that might be a
 tower climb."""
 
@@ -68,32 +94,55 @@ def main(argv):
 
   logging.basicConfig(stream=args.log, level=args.volume, format='%(message)s')
 
-  with args.filters.open() as filters_file:
-    filters = yaml.safe_load(filters_file)
-  ignore = set(filters['ignore'])
-  seen = {(s['title'], s['date']) for s in filters['seen']}
-
+  # Check this first, so we don't bother reading the filters if we're just going to exit.
   if SILENCE_FILE.exists():
     logging.warning(f'Warning: Silence file {str(SILENCE_FILE)} exists. Exiting..')
     return 1
 
-  headers = {'user-agent':USER_AGENT}
+  with args.filters.open() as filters_file:
+    filters = yaml.load(filters_file, Loader=YamlLoader)
+  ignore = frozenset(filters['ignore'])
+  seen = frozenset((s['title'], s['date']) for s in filters['seen'])
+
   try:
-    get_and_display_events(args.pages, headers, ignore, seen)
+    # Use one session for all the pages so the connection is kept alive between them.
+    with make_session() as session:
+      session.headers.update({'user-agent':USER_AGENT})
+      get_and_display_events(args.pages, session, ignore, seen)
   except RuntimeError as error:
     cmd = ZENITY_ERROR_CMD + [str(error)]
     subprocess.run(cmd, check=True)
 
 
-def get_and_display_events(pages, headers, ignore, seen):
+def make_session():
+  """Make a session that caches responses, if requests-cache is installed.
+  Cached pages are revalidated on every request, so unchanged pages come back as a quick 304 from
+  the server (if it supports ETag or Last-Modified).
+  The connection pool is sized to hold a connection for each of the concurrent page requests."""
+  if requests_cache is None:
+    session = requests.Session()
+  else:
+    session = requests_cache.CachedSession(
+      CACHE_FILE, backend='sqlite', cache_control=True,
+      expire_after=requests_cache.EXPIRE_IMMEDIATELY, allowable_methods=('GET', 'HEAD', 'POST')
+    )
+  adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_PAGE_THREADS)
+  session.mount('https://', adapter)
+  return session
+
+
+def get_and_display_events(pages, session, ignore, seen):
   with tempfile.NamedTemporaryFile(mode='w+t', prefix='cathedral.', suffix='.txt') as tmpfile:
+    # Most events won't have a title that's in the seen list at all, so check that first to avoid
+    # building a (title, date) tuple for them.
+    seen_titles = frozenset(title for title, date in seen)
     results = 0
-    for event in get_events(f'https://{DOMAIN}{CALENDAR_PATH}', headers, pages):
+    for event in get_events(f'https://{DOMAIN}{CALENDAR_PATH}', session, pages):
       logging.info(f'Found event on {event.date}: {event.title}')
       if event.title in ignore:
         logging.info('  in ignore list')
         continue
-      if (event.title, event.date) in seen:
+      if event.title in seen_titles and (event.title, event.date) in seen:
         logging.info('  in seen list')
         continue
       results += 1
@@ -114,41 +163,53 @@ class Event(typing.NamedTuple):
   tickets: str
 
 
-def get_events(url, headers, pages):
-  for page in range(1, pages+1):
-    params = {
-      'filters[modality]': 'in-person',
-      'filters[date]': '',
-      'filters[types][0]': 'sightseeing-tours',
-      'query': '',
-      'current_page': str(page)
-    }
-    logging.info(f'Requesting page {page}')
-    response = requests.post(url, headers=headers, params=params)
-    if response.status_code != 200:
-      raise RuntimeError(f'Received response code {response.status_code} {response.reason} on page {page}')
-    html_bytes = response.content
-    soup = bs4.BeautifulSoup(html_bytes, 'html.parser')
-    for day_elem in soup.find_all('div', class_='event_list_row'):
-      date = find_child_text(day_elem, HTML_FIELDS['date'])
-      day = find_child_text(day_elem, HTML_FIELDS['day'])
-      for event_elem in day_elem.find_all('li', class_='event_list_item'):
-        data = {'date':date, 'day':day}
-        for field in Event._fields:
-          if field not in data:
-            data[field] = find_child_text(event_elem, HTML_FIELDS[field])
-        yield Event(**data)
-
-
-def find_child_text(parent, spec):
-  child = parent.find(spec['tag'], class_=spec['class'])
-  if spec.get('attr'):
-    raw_text = child.attrs[spec['attr']]
+# The fields found in each event's element (the date and day come from the parent day element).
+EVENT_ITEM_FIELDS = tuple(field for field in Event._fields if field not in ('date', 'day'))
+
+
+def get_events(url, session, pages):
+  # The pages don't depend on each other, so request several at once (but not too many, to be polite
+  # to the server). They're still parsed in order, as each one becomes available.
+  workers = max(min(pages, MAX_PAGE_THREADS), 1)
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+    fetch_page = functools.partial(get_page, url, session)
+    for html_bytes in executor.map(fetch_page, range(1, pages+1)):
+      root = lxml.html.document_fromstring(html_bytes)
+      for day_elem in DAY_XPATH(root):
+        date = find_child_text(day_elem, 'date')
+        day = find_child_text(day_elem, 'day')
+        for event_elem in EVENT_XPATH(day_elem):
+          values = [find_child_text(event_elem, field) for field in EVENT_ITEM_FIELDS]
+          yield Event(date, day, *values)
+
+
+def get_page(url, session, page):
+  params = {
+    'filters[modality]': 'in-person',
+    'filters[date]': '',
+    'filters[types][0]': 'sightseeing-tours',
+    'query': '',
+    'current_page': str(page)
+  }
+  logging.info(f'Requesting page {page}')
+  response = session.post(url, params=params)
+  if response.status_code != 200:
+    raise RuntimeError(f'Received response code {response.status_code} {response.reason} on page {page}')
+  return response.content
+
+
+def find_child_text(parent, field):
+  spec = HTML_FIELDS[field]
+  children = FIELD_XPATHS[field](parent)
+  if not children:
+    raw_text = None
+  elif spec.get('attr'):
+    raw_text = children[0].get(spec['attr'])
   else:
-    raw_text = child.text
+    raw_text = children[0].text_content()
   if raw_text is None:
-    parent_desc = parent.name
-    class_ = parent.attrs.get("class")
+    parent_desc = parent.tag
+    class_ = parent.get('class')
     if class_:
       parent_desc += '.'+class_
     message = f'Problem searching for child of {parent_desc} with spec {spec}'
@@ -156,6 +217,7 @@ def find_child_text(parent, spec):
       raise RuntimeError(message)
     else:
       logging.warning(message)
+      return None
   return raw_text.strip()
 
 
@@ -28,7 +28,22 @@ ISSUERS = {
   }
 }
 
+# The Luhn algorithm's doubled value of each digit (the digits of the product are summed, so
+# 7 -> 14 -> 5).
+LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+# Card numbers are stored as bytearrays of digit values (0-9). These translate between those and the
+# ASCII digit characters.
+CHARS_TO_DIGITS = bytes.maketrans(b'0123456789', bytes(range(10)))
+DIGITS_TO_CHARS = bytes.maketrans(bytes(range(10)), b'0123456789')
+
 ISSUER_NAMES = [issuer['name'] for issuer in ISSUERS.values()]
+# Each IIN range as a (issuer name, number of digits, low, high) tuple.
+IIN_TABLE = tuple(
+  (issuer['name'], len(str(low)), low, high)
+  for issuer in ISSUERS.values() for low, high in issuer['IINs']
+)
+IIN_MAX_LEN = max(iin_len for name, iin_len, low, high in IIN_TABLE)
 
 DESCRIPTION = """Generate a random credit card number that's valid according to the luhn algorithm.
 Or, check whether a credit card number is valid. When generating a random card, by default, it will
@@ -80,30 +95,27 @@ def main(argv):
 
 
 def str_from_cc(cc):
-  return ''.join(map(str, cc))
+  return bytes(cc).translate(DIGITS_TO_CHARS).decode('ascii')
 
 
 def cc_from_str(cc_str):
-  return [int(char) for char in cc_str]
+  if not (cc_str.isascii() and cc_str.isdigit()):
+    raise ValueError(f'Invalid card number {cc_str!r}: must be all digits.')
+  return bytearray(cc_str.encode('ascii').translate(CHARS_TO_DIGITS))
 
 
 def is_valid_cc(cc):
   """Return True if the Luhn checksum of the number is 0.
-  The input must be a list of integers."""
+  The input must be a sequence of integers (like the bytearray from cc_from_str())."""
   return get_luhn_checksum(cc) == 0
 
 
 def get_luhn_checksum(cc):
   # The number is valid if this is 0.
-  sum = 0
+  # Every other digit, counting from the second-to-last one, is doubled (using the lookup table).
   parity = len(cc) % 2
-  for i, digit in enumerate(cc):
-    if i % 2 == parity:
-      digit *= 2
-      if digit > 9:
-        digit -= 9
-    sum += digit
-  return sum % 10
+  doubled_sum = sum(LUHN_DOUBLED[digit] for digit in cc[parity::2])
+  return (doubled_sum + sum(cc[1-parity::2])) % 10
 
 
 def make_random_cc(issuer=None):
@@ -119,30 +131,35 @@ def make_random_cc(issuer=None):
 def get_rand_iin(issuer):
   iin_range = random.choice(issuer['IINs'])
   iin_int = random.randint(*iin_range)
-  return [int(i) for i in str(iin_int)]
+  return cc_from_str(str(iin_int))
 
 
 def get_rand_digits(num_digits):
-  digits = []
-  for i in range(num_digits):
-    digits.append(random.randint(0, 9))
-  return digits
+  # Draw random bytes in bulk and map them to digits. Bytes 250-255 are thrown out so every digit is
+  # equally likely.
+  digits = bytearray()
+  while len(digits) < num_digits:
+    digits.extend(byte % 10 for byte in random.randbytes(num_digits) if byte < 250)
+  return digits[:num_digits]
 
 
 def make_cc_valid(cc):
-  while not is_valid_cc(cc):
-    cc[-1] = (cc[-1]+1) % 10
+  # The last digit is never doubled, so changing it changes the checksum by the same amount.
+  # Just subtract the current checksum from it to bring the checksum to 0.
+  cc[-1] = (cc[-1] - get_luhn_checksum(cc)) % 10
   return cc
 
 
 def get_issuer(cc):
-  for issuer in ISSUERS.values():
-    for iin_range in issuer['IINs']:
-      iin_len = len(str(iin_range[0]))
-      iin = cc[:iin_len]
-      iin_int = int(''.join([str(i) for i in iin]))
-      if iin_range[0] <= iin_int <= iin_range[1]:
-        return issuer['name']
+  # Get the integer value of each prefix of the number, up to the longest IIN.
+  # E.g. [4, 5, 3, 2, ...] -> [0, 4, 45, 453, 4532]
+  prefixes = [0]
+  for digit in cc[:IIN_MAX_LEN]:
+    prefixes.append(prefixes[-1]*10 + digit)
+  for name, iin_len, low, high in IIN_TABLE:
+    iin_int = prefixes[min(iin_len, len(prefixes)-1)]
+    if low <= iin_int <= high:
+      return name
   return None
 
 
@@ -1,27 +1,49 @@
 #!/usr/bin/env python3
-import argparse
-import collections
 import datetime
+import hashlib
+import itertools
 import logging
+import operator
+import os
 import pathlib
+import pickle
+import re
+import stat
 import sys
-import yaml
+import tempfile
+import types
 assert sys.version_info.major >= 3, 'Python 3 required'
 
-PERIODS = collections.OrderedDict(
-  (
-    ('min', {'dt':lambda dt: dt.minute}),
-    ('hr',  {'dt':lambda dt: dt.hour}),
-    ('dom', {'dt':lambda dt: dt.day}),
-    ('mon', {'dt':lambda dt: dt.month}),
-    ('week',{'dt':lambda dt: dt.weekday()+1})
-  )
+# The fields of a #?when parameter, in order, and how to get each one's value from a datetime.
+PERIODS = (
+  ('min', operator.attrgetter('minute')),
+  ('hr',  operator.attrgetter('hour')),
+  ('dom', operator.attrgetter('day')),
+  ('mon', operator.attrgetter('month')),
+  ('week',operator.methodcaller('isoweekday')),
 )
-
+# The periods that determine which day(s) to execute on.
+DAY_PERIODS = PERIODS[2:]
+
+MAX_CAT_THREADS = 8
+# Each chunk of the input starts with a #! command line.
+CHUNK_START_RE = re.compile(r'^(?=#!)', re.MULTILINE)
+CONFIG_CACHE_DIR = pathlib.Path('~/.cache/dispatcher').expanduser()
+# The options parse_args_fast() understands, mapped to their destinations.
+VALUE_OPTIONS = {
+  '-c':'config', '--config':'config', '-w':'whitelist', '--whitelist':'whitelist',
+  '-p':'precision', '--precision':'precision', '-l':'log', '--log':'log',
+}
+VOLUME_OPTIONS = {
+  '-q':logging.CRITICAL, '--quiet':logging.CRITICAL, '-v':logging.INFO, '--verbose':logging.INFO,
+  '-D':logging.DEBUG, '--debug':logging.DEBUG,
+}
 DESCRIPTION = """Take actions based on the content of a simple input file."""
 
 
 def make_argparser():
+  # argparse is only imported when parse_args_fast() can't handle the command line.
+  import argparse
   parser = argparse.ArgumentParser(add_help=False, description=DESCRIPTION)
   options = parser.add_argument_group('Options')
   options.add_argument('infile', type=argparse.FileType('r'), default=sys.stdin, nargs='?',
@@ -50,8 +72,10 @@ def make_argparser():
 
 def main(argv):
 
-  parser = make_argparser()
-  args = parser.parse_args(argv[1:])
+  args = parse_args_fast(argv[1:])
+  if args is None:
+    parser = make_argparser()
+    args = parser.parse_args(argv[1:])
 
   logging.basicConfig(stream=args.log, level=args.volume, format='%(message)s')
 
@@ -60,6 +84,10 @@ def main(argv):
     read_config(args.config, static_params)
   for path in args.whitelist:
     static_params['whitelist'].append(path.resolve())
+  # Precompute the path prefixes for checking whether a path is under a whitelisted directory.
+  static_params['whitelist_prefixes'] = tuple(f'{path}/' for path in static_params['whitelist'])
+  # Shared by all chunks, to remember which paths have already been resolved.
+  static_params['path_cache'] = {}
 
   for lines in chunk_input(args.infile):
     # Parse the chunk.
@@ -84,8 +112,77 @@ def main(argv):
     fxn(chunk_args, content, params)
 
 
+def parse_args_fast(arguments):
+  """Parse the command line in a single pass, without argparse (which is slow to import and set up).
+  This only handles ordinary invocations: it returns None on --help, any error, or anything unusual
+  (like abbreviated options), so that argparse can handle those with its usual messages."""
+  values = {'infile':None, 'config':None, 'whitelist':[], 'precision':None, 'log':None}
+  volume = None
+  i = 0
+  while i < len(arguments):
+    arg = arguments[i]
+    i += 1
+    if arg in VOLUME_OPTIONS:
+      if volume is not None:
+        return None
+      volume = VOLUME_OPTIONS[arg]
+      continue
+    if arg == '-' or not arg.startswith('-'):
+      if values['infile'] is not None:
+        return None
+      values['infile'] = arg
+      continue
+    option, equals, value = arg.partition('=')
+    dest = VALUE_OPTIONS.get(option)
+    if dest is None or (equals and not option.startswith('--')):
+      return None
+    if not equals:
+      if i >= len(arguments):
+        return None
+      value = arguments[i]
+      i += 1
+      if value.startswith('-') and value != '-':
+        return None
+    if dest == 'whitelist':
+      values['whitelist'].append(pathlib.Path(value))
+    elif values[dest] is not None:
+      return None
+    else:
+      values[dest] = value
+  if values['precision'] is not None:
+    try:
+      values['precision'] = int(values['precision'])
+    except ValueError:
+      return None
+  # Open the files last, once we know the arguments are valid.
+  files = {}
+  try:
+    file_args = (('infile', 'r', sys.stdin), ('config', 'r', None), ('log', 'w', sys.stderr))
+    for dest, mode, default in file_args:
+      files[dest] = open_arg_file(values[dest], mode, default)
+  except OSError:
+    for file in files.values():
+      if file not in (None, sys.stdin, sys.stdout, sys.stderr):
+        file.close()
+    return None
+  values.update(files)
+  if volume is None:
+    volume = logging.WARNING
+  return types.SimpleNamespace(volume=volume, **values)
+
+
+def open_arg_file(path, mode, default):
+  """Open a file argument the way argparse.FileType would."""
+  if path is None:
+    return default
+  elif path == '-':
+    return sys.stdin if 'r' in mode else sys.stdout
+  else:
+    return open(path, mode)
+
+
 def read_config(config_file, params):
-  data = yaml.safe_load(config_file)
+  data = load_config_data(config_file)
   if 'whitelist' in data:
     for path_str in data['whitelist']:
       path = pathlib.Path(path_str).expanduser()
@@ -94,17 +191,72 @@ def read_config(config_file, params):
       params['whitelist'].append(path)
 
 
-def chunk_input(lines):
-  chunk_lines = []
-  for line_raw in lines:
-    line = line_raw.rstrip('\r\n')
-    if line.startswith('#!'):
-      if chunk_lines:
-        yield chunk_lines
-      chunk_lines = []
-    chunk_lines.append(line)
-  if chunk_lines:
-    yield chunk_lines
+def load_config_data(config_file):
+  """Parse the YAML config file, or load the result from the cache if the file hasn't changed since
+  it was last parsed."""
+  cache_path, file_key = get_config_cache_info(config_file)
+  if cache_path is not None:
+    try:
+      with cache_path.open('rb') as cache_file:
+        cached_key, data = pickle.load(cache_file)
+      if cached_key == file_key:
+        logging.debug(f'Debug: Loaded config from cache {str(cache_path)!r}')
+        return data
+    except Exception:
+      # The cache is only an optimization. If it's unreadable or holds something unexpected (like a
+      # different object or a class that no longer exists), just parse the YAML again.
+      pass
+  # PyYAML takes a while to import, and it's only needed when the config isn't cached.
+  import yaml
+  # Use the libyaml-backed C loader, if PyYAML was built with it.
+  try:
+    from yaml import CSafeLoader as YamlLoader
+  except ImportError:
+    from yaml import SafeLoader as YamlLoader
+  data = yaml.load(config_file.read(), Loader=YamlLoader)
+  if cache_path is not None:
+    write_config_cache(cache_path, file_key, data)
+  return data
+
+
+def get_config_cache_info(config_file):
+  """Get the path to the cache file for this config file, and the key identifying the current
+  version of the config file (its path, modification time, and size).
+  Returns (None, None) if the config isn't a regular file (like stdin)."""
+  try:
+    stats = os.fstat(config_file.fileno())
+  except (AttributeError, OSError, ValueError):
+    return None, None
+  if not stat.S_ISREG(stats.st_mode):
+    return None, None
+  path = os.path.realpath(config_file.name)
+  path_hash = hashlib.sha1(path.encode('utf8', 'surrogateescape')).hexdigest()
+  cache_path = CONFIG_CACHE_DIR / f'config.{path_hash}.pkl'
+  return cache_path, (path, stats.st_mtime_ns, stats.st_size)
+
+
+def write_config_cache(cache_path, file_key, data):
+  # Write to a temporary file and rename it, so a concurrent run never reads a partial cache file.
+  try:
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('wb', dir=cache_path.parent, delete=False) as tmp_file:
+      pickle.dump((file_key, data), tmp_file)
+    os.replace(tmp_file.name, cache_path)
+  except OSError as error:
+    logging.warning(f'Warning: Could not write config cache {str(cache_path)!r}: {error}')
+
+
+def chunk_input(infile):
+  """Read the input and yield each chunk as a list of lines (without newlines)."""
+  # Split the whole input at once instead of going line by line.
+  data = infile.read()
+  for chunk in CHUNK_START_RE.split(data):
+    if not chunk:
+      continue
+    if chunk.endswith('\n'):
+      chunk = chunk[:-1]
+    # stdin doesn't translate newlines, so CRLF line endings leave a '\r' to strip.
+    yield [line.rstrip('\r') for line in chunk.split('\n')]
 
 
 def parse_chunk(chunk_lines):
@@ -151,18 +303,24 @@ def parse_when_param(args):
     raise ValueError(
       f'Wrong number of arguments to when parameter (saw {len(args)}, need {len(PERIODS)}).'
     )
-  time_spec = {}
-  for period, arg in zip(PERIODS, args):
-    if arg == '*':
-      value = None
-    else:
-      try:
-        value = int(arg)
-      except ValueError as error:
-        error.args = (f'Invalid when parameter {arg!r} (not an integer or *)',)
-        raise error
-    time_spec[period] = value
-  return time_spec
+  min_arg, hr_arg, dom_arg, mon_arg, week_arg = args
+  return {
+    'min': parse_when_value(min_arg),
+    'hr': parse_when_value(hr_arg),
+    'dom': parse_when_value(dom_arg),
+    'mon': parse_when_value(mon_arg),
+    'week': parse_when_value(week_arg),
+  }
+
+
+def parse_when_value(arg):
+  if arg == '*':
+    return None
+  try:
+    return int(arg)
+  except ValueError as error:
+    error.args = (f'Invalid when parameter {arg!r} (not an integer or *)',)
+    raise error
 
 
 def execute_now(time_spec, precision):
@@ -171,24 +329,21 @@ def execute_now(time_spec, precision):
     return None
   now = datetime.datetime.now()
   # If the time_spec includes a day of any kind, are we on the right day?
-  for period, spec_value in time_spec.items():
-    if period in ('min', 'hr'):
-      continue
-    elif spec_value is None:
-      continue
-    dt_converter = PERIODS[period]['dt']
-    current_value = dt_converter(now)
-    if current_value != spec_value:
+  for period, getter in DAY_PERIODS:
+    spec_value = time_spec[period]
+    if spec_value is not None and getter(now) != spec_value:
       return False
   # How many minutes after the time_spec are we executing?
+  now_hr = now.hour
+  now_min = now.minute
   spec_hr = time_spec['hr']
   if spec_hr is None:
-    spec_hr = now.hour
+    spec_hr = now_hr
   spec_min = time_spec['min']
   if spec_min is None:
-    spec_min = now.minute
+    spec_min = now_min
   spec_minutes = spec_hr*60 + spec_min
-  now_minutes = now.hour*60 + now.minute
+  now_minutes = now_hr*60 + now_min
   diff = now_minutes - spec_minutes
   if diff < 0:
     diff += 24*60
@@ -208,21 +363,56 @@ def do_echo(args, content, params):
 
 
 def do_cat(args, content, params):
-  whitelist = params.get('whitelist', ())
-  for path_str in args:
-    path = pathlib.Path(path_str).resolve()
-    if not in_whitelist(path, whitelist):
-      logging.error(f'Error: Path not in whitelist: {str(path)!r}')
-      continue
-    if not path.parent.is_dir():
-      logging.error(f'Error: Directory containing {str(path)!r} not found.')
-      continue
-    try:
-      with path.open('w') as file:
-        for line in content:
-          print(line, file=file)
-    except OSError as error:
-      logging.error(f'Error: Failed writing to file {str(path)!r}: {error}')
+  whitelist_prefixes = params.get('whitelist_prefixes', ())
+  # Build the text once, to be shared by every file.
+  if content:
+    text = '\n'.join(content)+'\n'
+  else:
+    text = ''
+  path_cache = params.get('path_cache', {})
+  targets = [resolve_path(path_str, whitelist_prefixes, path_cache) for path_str in args]
+  if len(targets) <= 1:
+    errors = [cat_file(target, text) for target in targets]
+  else:
+    # Write to the files concurrently, so the time waiting on each one overlaps.
+    # Only imported here, since most commands write a single file.
+    import concurrent.futures
+    workers = min(len(targets), MAX_CAT_THREADS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+      errors = list(executor.map(cat_file, targets, itertools.repeat(text)))
+  # Report any problems in the same order as the paths were given.
+  for error in errors:
+    if error is not None:
+      logging.error(error)
+
+
+def resolve_path(path_str, whitelist_prefixes, path_cache):
+  """Get the real path of `path_str` and whether it's in the whitelist, as a (path, allowed) tuple.
+  The same few files are often written by many chunks, so results are saved in `path_cache`."""
+  try:
+    return path_cache[path_str]
+  except KeyError:
+    pass
+  path = os.path.realpath(path_str)
+  target = (path, in_whitelist(path, whitelist_prefixes))
+  path_cache[path_str] = target
+  return target
+
+
+def cat_file(target, text):
+  """Write `text` to the file from a resolve_path() `target`.
+  Returns an error message on failure, or None on success."""
+  path, allowed = target
+  if not allowed:
+    return f'Error: Path not in whitelist: {path!r}'
+  if not os.path.isdir(os.path.dirname(path)):
+    return f'Error: Directory containing {path!r} not found.'
+  try:
+    with open(path, 'w') as file:
+      file.write(text)
+  except OSError as error:
+    return f'Error: Failed writing to file {path!r}: {error}'
+  return None
 
 
 COMMANDS = {
@@ -231,11 +421,10 @@ COMMANDS = {
 }
 
 
-def in_whitelist(path, whitelist):
-  for directory in whitelist:
-    if str(path).startswith(f'{directory}/'):
-      return True
-  return False
+def in_whitelist(path, whitelist_prefixes):
+  """`path` is an absolute path string. `whitelist_prefixes` is a tuple of whitelisted directories,
+  each with a trailing slash."""
+  return path.startswith(whitelist_prefixes)
 
 
 def fail(message):
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import argparse
+import bisect
+import collections
 import datetime
 import logging
 import subprocess
@@ -7,6 +9,22 @@ import sys
 import time
 assert sys.version_info.major >= 3, 'Python 3 required'
 
+# How many of the most recent counts to use when estimating the rate of progress.
+SAMPLE_WINDOW = 64
+# The units human_time_amount() uses, with the number of seconds in each, and the amount of time at
+# which it switches to the next unit.
+TIME_UNITS = (
+  ('second', 1),
+  ('minute', 60),
+  ('hour', 60*60),
+  ('day', 24*60*60),
+  ('week', 7*24*60*60),
+  ('month', 30.5*24*60*60),
+  ('year', 365*24*60*60),
+)
+TIME_UNIT_LIMITS = (60, 60*60, 24*60*60, 10*24*60*60, 40*24*60*60, 365*24*60*60)
+THREE_MONTHS = datetime.timedelta(weeks=12)
+ONE_YEAR = datetime.timedelta(days=364)
 USAGE = '$ %(prog)s [options] goal command [args]'
 DESCRIPTION = """Estimate the time to reach a goal count."""
 
@@ -22,6 +40,9 @@ def make_argparser():
     help='The whitespace-delimited field of the output to use as the count (1-based).')
   options.add_argument('-e', '--eval', action='store_true', default=False,
     help='The first "command" argument is a full command line. Execute as a literal shell line.')
+  options.add_argument('-S', '--stream', action='store_true',
+    help="Run the command only once, and read a new count from each line it prints, instead of "
+      'running it again for every check. --pause and --initial-pause are ignored.')
   options.add_argument('-p', '--pause', type=float, default=5*60,
     help='Seconds to wait between checks. Default: %(default)d')
   options.add_argument('-i', '--initial-pause', type=int, default=15,
@@ -54,8 +75,17 @@ def main(argv):
   if args.eval and len(args.command) > 1:
     fail('The command line should be a single, quoted argument when using --eval.')
 
+  if args.stream:
+    counts = stream_counts(args.command, args.field, args.eval)
+  else:
+    counts = poll_counts(args.command, args.field, args.eval, args.pause, args.initial_pause)
+
   if args.start_count is not None:
     start_count = args.start_count
+  elif args.stream:
+    start_count = next(counts, None)
+    if start_count is None:
+      fail('No output returned from command')
   else:
     start_count = get_current_count(args.command, args.field, args.eval)
 
@@ -63,39 +93,55 @@ def main(argv):
   ratio = start_count/args.goal
   print(f'Initial time: {start} | Initial count: {start_count} ({ratio:0.1%}) | Goal: {args.goal}')
 
-  watch_progress(
-    args.start_time, start_count, args.goal, args.command, args.field, args.pause, args.eval,
-    args.initial_pause
-  )
+  if not watch_progress(args.start_time, start_count, args.goal, counts):
+    fail('Command exited before the goal was reached.')
 
   elapsed_str = human_time_amount(time.time() - args.start_time)
   print(f'Goal reached! Total time: {elapsed_str}')
 
 
-def watch_progress(start_time, start_count, goal, command, field, pause, eval_, initial_pause):
-  first_loop = True
-  current_count = last_count = start_count
-  remaining = 1
-  while remaining > 0:
-    first_loop = sleep(pause, initial_pause, first_loop)
-    current_count = get_current_count(command, field, eval_)
+def watch_progress(start_time, start_count, goal, counts):
+  """Print the estimated time left for each count from `counts` until the goal is reached.
+  Returns True when it's reached, or False if `counts` runs out first."""
+  last_count = start_count
+  # The (time, count) of recent checks, for estimating the rate.
+  samples = collections.deque([(start_time, start_count)], maxlen=SAMPLE_WINDOW)
+  for current_count in counts:
     if current_count == start_count:
       logging.warning(f'No progress yet! Count at {current_count}')
       continue
     now = time.time()
-    remaining = calc_remaining(start_count, start_time, current_count, now, goal)
-    if remaining > 0:
-      print(format_status(current_count, last_count, goal, now, remaining))
+    samples.append((now, current_count))
+    remaining = calc_remaining(start_count, samples, current_count, goal)
+    if remaining <= 0:
+      return True
+    print(format_status(current_count, last_count, goal, now, remaining))
     last_count = current_count
+  return False
 
 
-def sleep(pause, initial_pause, first_loop):
-  if first_loop:
-    time.sleep(initial_pause)
-    first_loop = False
-  else:
+def poll_counts(command, field, eval_, pause, initial_pause):
+  """Wait `initial_pause` sec, then run the command every `pause` sec and yield each count."""
+  time.sleep(initial_pause)
+  while True:
+    yield get_current_count(command, field, eval_)
     time.sleep(pause)
-  return first_loop
+
+
+def stream_counts(command, field, eval_):
+  """Run the command once and yield a count from each non-blank line of its output.
+  This avoids starting a new process for every check, for commands that can report progress
+  continuously."""
+  process = subprocess.Popen(command, shell=eval_, encoding='utf8', stdout=subprocess.PIPE)
+  try:
+    for line in process.stdout:
+      if line.strip():
+        yield parse_result(line, field)
+  finally:
+    # Don't leave the command running once we've reached the goal.
+    process.terminate()
+    process.stdout.close()
+    process.wait()
 
 
 def get_current_count(command, field, eval_):
@@ -104,10 +150,18 @@ def get_current_count(command, field, eval_):
 
 
 def parse_result(result_str, field):
-  lines = result_str.splitlines()
-  if not lines:
+  if not result_str:
     raise ValueError('No output returned from command')
-  last_line = lines[-1]
+  # Find the last line without splitting the whole output into lines.
+  # Like splitlines(), this treats \n, \r, and \r\n as line endings.
+  if result_str.endswith('\r\n'):
+    end = len(result_str) - 2
+  elif result_str.endswith(('\n', '\r')):
+    end = len(result_str) - 1
+  else:
+    end = len(result_str)
+  start = max(result_str.rfind('\n', 0, end), result_str.rfind('\r', 0, end)) + 1
+  last_line = result_str[start:end]
   if field:
     fields = last_line.split()
     if len(fields) < field:
@@ -129,37 +183,60 @@ def format_status(current_count, last_count, goal, now, remaining):
     return f'{current_str} | ETA: ??? (count has decreased)'
   else:
     remaining_str = human_time_amount(remaining)
-    eta_str = human_timestamp(now+remaining)
+    eta_str = human_timestamp(now+remaining, datetime.datetime.fromtimestamp(now))
     return f'{current_str} | ETA: {eta_str} ({remaining_str})'
 
 
-def calc_remaining(start_count, start_time, current_count, current_time, goal):
+def calc_remaining(start_count, samples, current_count, goal):
+  """Estimate the seconds left until the goal, from the rate of change over the `samples`."""
+  rate = get_rate(samples)
   if goal > start_count:
     # We're counting up to the goal.
-    progress = current_count - start_count
     count_left = goal - current_count
   else:
     # We're counting down to the goal.
-    progress = start_count - current_count
     count_left = current_count - goal
-  if progress < 0:
+    rate = -rate
+  if count_left <= 0:
+    return 0
+  elif rate <= 0:
     return float('inf')
   else:
-    elapsed = current_time - start_time
-    count_per_sec = progress / elapsed
-    return count_left / count_per_sec
-
-
-def human_timestamp(timestamp):
-  now = datetime.datetime.now()
+    return count_left / rate
+
+
+def get_rate(samples):
+  """Get the change in count per second, as the least-squares slope of the (time, count) samples.
+  With only two samples, this is just the change between them divided by the time between them."""
+  # Measure times relative to the first sample, to keep the squares small.
+  start_time = samples[0][0]
+  times = [sample_time - start_time for sample_time, count in samples]
+  counts = [count for sample_time, count in samples]
+  mean_time = sum(times) / len(times)
+  mean_count = sum(counts) / len(counts)
+  covariance = variance = 0
+  for sample_time, count in zip(times, counts):
+    time_diff = sample_time - mean_time
+    covariance += time_diff * (count - mean_count)
+    variance += time_diff * time_diff
+  if variance == 0:
+    return 0
+  return covariance / variance
+
+
+def human_timestamp(timestamp, now=None):
+  """`now` is the current time as a datetime (default: `datetime.datetime.now()`)."""
+  if now is None:
+    now = datetime.datetime.now()
   then = datetime.datetime.fromtimestamp(timestamp)
-  if then.strftime('%Y-%m-%d') == now.strftime('%Y-%m-%d'):
+  if then.toordinal() == now.toordinal():
     # It's today. Just return the time.
     return then.strftime(f'{get_12hr(then):2d}:%M:%S %p')
-  elif then - now < datetime.timedelta(weeks=12):
+  time_left = then - now
+  if time_left < THREE_MONTHS:
     # It's another day, but within 3 months.
     return then.strftime(f'%b {then.day:2d} {get_12hr(then):2d}:%M %p')
-  elif then - now < datetime.timedelta(days=364):
+  elif time_left < ONE_YEAR:
     # It's within a year.
     return then.strftime(f'%b {then.day:2d}')
   else:
@@ -174,20 +251,11 @@ def get_12hr(dt):
 
 
 def human_time_amount(sec):
-  if sec < 60:
+  index = bisect.bisect_right(TIME_UNIT_LIMITS, sec)
+  if index == 0:
     return format_time(round(sec), 'second')
-  elif sec < 60*60:
-    return format_time(sec/60, 'minute')
-  elif sec < 24*60*60:
-    return format_time(sec/60/60, 'hour')
-  elif sec < 10*24*60*60:
-    return format_time(sec/60/60/24, 'day')
-  elif sec < 40*24*60*60:
-    return format_time(sec/60/60/24/7, 'week')
-  elif sec < 365*24*60*60:
-    return format_time(sec/60/60/24/30.5, 'month')
-  else:
-    return format_time(sec/60/60/24/365, 'year')
+  unit, seconds_per_unit = TIME_UNITS[index]
+  return format_time(sec/seconds_per_unit, unit)
 
 
 def format_time(quantity, unit):
@@ -3,16 +3,31 @@ import os
 import sys
 import time
 import json
+import mmap
 import shutil
 import logging
+import operator
+import itertools
 import pathlib
 import tempfile
 import argparse
 import subprocess
 import configparser
+try:
+  import lz4.block
+except ImportError:
+  lz4 = None
+try:
+  import orjson
+except ImportError:
+  orjson = None
 assert sys.version_info.major >= 3, 'Python 3 required'
 
 DEFAULT_FIREFOX_DIR = pathlib.Path('~/.mozilla/firefox').expanduser()
+# The header at the start of Mozilla's jsonlz4 files, before the LZ4 block.
+MOZLZ4_MAGIC = b'mozLz40\0'
+# JSON files at least this big are memory-mapped instead of read.
+MMAP_MIN_SIZE = 1024*1024
 
 DESCRIPTION = """Read and manipulate browsing sessions from Firefox.
 Firefox's sessions can be found in the profile folders under ~/.mozilla/firefox.
@@ -89,7 +104,7 @@ def main(argv):
   if args.compress:
     if not args.format == 'json':
       fail('Error: Can only use --compress on --json output.')
-    if not shutil.which('jsonlz4'):
+    if lz4 is None and not shutil.which('jsonlz4'):
       fail('Error: Cannot find "jsonlz4" command to --compress output.')
 
   targets = set()
@@ -124,10 +139,12 @@ def main(argv):
     if args.compress:
       write_jsonlz4(session, args.compress)
     else:
-      json.dump(session, sys.stdout)
+      sys.stdout.buffer.write(dump_json(session))
   else:
     output = format_contents(session, args.titles, args.urls, args.format, args.closed)
-    print(*output, sep='\n')
+    # Write the lines in one C-level loop instead of passing them all through print().
+    # (An empty output is still printed as a blank line, like print() did.)
+    sys.stdout.writelines(line+'\n' for line in output or [''])
 
 
 def parse_window_spec(window_spec):
@@ -144,7 +161,7 @@ def parse_window_spec(window_spec):
 def read_session_file(session_path, input_format=None):
   if session_path == '-':
     # If it's coming into stdin, assume it's already pure JSON.
-    return json.load(sys.stdin)
+    return load_json(sys.stdin.buffer.read())
   # Detect format by file extension, if the user hasn't specified.
   if input_format is None:
     ext = session_path.suffix
@@ -159,27 +176,75 @@ def read_session_file(session_path, input_format=None):
   # Read the different formats.
   if input_format == 'jsonlz4':
     # It's JSON compressed in Mozilla's custom format.
-    if not shutil.which('dejsonlz4'):
-      fail('Error: Cannot find "dejsonlz4" command to decompress session file.')
-    process = subprocess.Popen(['dejsonlz4', session_path, '-'], stdout=subprocess.PIPE)
-    session_str = str(process.stdout.read(), 'utf8')
-    return json.loads(session_str)
+    return load_json(read_jsonlz4(session_path))
   elif input_format == 'session':
     # It's a Session Manager .session file.
     return session_file_to_json(session_path)
   elif input_format == 'json':
     # It's a pure JSON file.
-    with session_path.open() as session_file:
-      return json.load(session_file)
+    return read_json_file(session_path)
+
+
+def read_jsonlz4(path):
+  """Decompress a jsonlz4 file and return the JSON as bytes.
+  Done in-process if the lz4 module is installed. Otherwise, this uses the dejsonlz4 command."""
+  if lz4 is None:
+    if not shutil.which('dejsonlz4'):
+      fail('Error: Cannot find "dejsonlz4" command to decompress session file.')
+    process = subprocess.run(['dejsonlz4', path, '-'], stdout=subprocess.PIPE)
+    return process.stdout
+  with open(path, 'rb') as file:
+    data = file.read()
+  if not data.startswith(MOZLZ4_MAGIC):
+    fail(f'Error: {str(path)!r} is not a jsonlz4 file (no {MOZLZ4_MAGIC!r} header).')
+  # The LZ4 block starts with the uncompressed size, which lz4.block expects by default.
+  return lz4.block.decompress(memoryview(data)[len(MOZLZ4_MAGIC):])
 
 
 def session_file_to_json(path):
-  line_num = 0
-  with path.open('rU', encoding='utf8') as file:
-    for line in file:
-      line_num += 1
-      if line_num == 5:
-        return json.loads(line)
+  # The JSON is on the 5th line.
+  with path.open('rb') as file:
+    line = next(itertools.islice(file, 4, 5), None)
+  if line is not None:
+    return load_json(line)
+
+
+def read_json_file(path):
+  """Read and parse a JSON file.
+  Large files are memory-mapped and given straight to orjson, instead of first being copied into
+  memory."""
+  with path.open('rb') as file:
+    if orjson is not None and os.fstat(file.fileno()).st_size >= MMAP_MIN_SIZE:
+      with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        with memoryview(mapped) as view:
+          try:
+            return orjson.loads(view)
+          except orjson.JSONDecodeError:
+            # Let load_json() try it with json.
+            pass
+    return load_json(file.read())
+
+
+def load_json(data):
+  """Parse JSON from bytes or a str, using orjson if it's installed."""
+  if orjson is not None:
+    try:
+      return orjson.loads(data)
+    except orjson.JSONDecodeError:
+      # orjson rejects some things json accepts (like NaN), so let json have a try before giving up.
+      pass
+  return json.loads(data)
+
+
+def dump_json(data, sort_keys=False):
+  """Serialize to JSON bytes, using orjson if it's installed."""
+  if orjson is not None:
+    try:
+      return orjson.dumps(data, option=orjson.OPT_SORT_KEYS if sort_keys else None)
+    except orjson.JSONEncodeError:
+      # Like for integers over 64 bits.
+      pass
+  return json.dumps(data, sort_keys=sort_keys).encode('utf8')
 
 
 def filter_session(session, targets):
@@ -204,6 +269,9 @@ def filter_session(session, targets):
       hits.add((w+1, tabs))
       if w+1 == selected_window:
         new_session['selectedWindow'] = len(new_session['windows'])
+      # Stop once every target's been found.
+      if len(hits) == len(targets):
+        break
   if new_session['selectedWindow'] is None:
     new_session['selectedWindow'] = 1
   # Check there weren't targets given with no match.
@@ -238,9 +306,14 @@ def join_sessions(session1, session2):
   windows1.extend(session2['windows'])
   new_session['windows'] = windows1
   # _closedWindows key:
+  # Compare closed windows by their (key-sorted) JSON, so checking for duplicates is a set lookup
+  # instead of comparing against every window so far.
   closed_windows = session1.get('_closedWindows', [])
+  seen = {dump_json(closed_window, sort_keys=True) for closed_window in closed_windows}
   for closed_window in session2.get('_closedWindows', []):
-    if closed_window not in closed_windows:
+    window_json = dump_json(closed_window, sort_keys=True)
+    if window_json not in seen:
+      seen.add(window_json)
       closed_windows.append(closed_window)
   new_session['_closedWindows'] = closed_windows
   # cookies key:
@@ -298,35 +371,31 @@ def join_sessions(session1, session2):
 
 def join_cookies(cookie_list1, cookie_list2):
   #TODO: Double-check what actually makes a cookie unique.
-  # Build cookie indices.
-  cookies_index1 = index_cookies(cookie_list1)
-  cookies_index2 = index_cookies(cookie_list2)
-  new_cookies = []
-  for cookie in cookie_list1 + cookie_list2:
-    key = (cookie.get('host'), cookie.get('name'), cookie.get('path'))
-    if key in cookies_index1:
+  get_key = operator.itemgetter('host', 'name', 'path')
+  cookies = {}
+  for cookie_list in (cookie_list1, cookie_list2):
+    for cookie in cookie_list:
+      try:
+        key = get_key(cookie)
+      except KeyError:
+        key = (cookie.get('host'), cookie.get('name'), cookie.get('path'))
       # If there's duplicate cookies, arbitrarily prefer the first one.
-      new_cookies.append(cookies_index1[key])
-    elif key in cookies_index2:
-      new_cookies.append(cookies_index2[key])
-  return new_cookies
-
-
-def index_cookies(cookie_list):
-  cookies_index = {}
-  for cookie in cookie_list:
-    key = (cookie.get('host'), cookie.get('name'), cookie.get('path'))
-    cookies_index[key] = cookie
-  return cookies_index
+      cookies.setdefault(key, cookie)
+  return list(cookies.values())
 
 
 def write_jsonlz4(session, jsonlz4_path):
-  #TODO: Apparently it's possible to do this in pure Python:
-  # https://unix.stackexchange.com/questions/326897/how-to-decompress-jsonlz4-files-firefox-bookmark-backups-using-the-command-lin/434882#434882
+  if lz4 is not None:
+    session_bytes = dump_json(session)
+    with open(jsonlz4_path, 'wb') as jsonlz4_file:
+      jsonlz4_file.write(MOZLZ4_MAGIC)
+      jsonlz4_file.write(lz4.block.compress(session_bytes))
+    return
+  # Without the lz4 module, fall back to the jsonlz4 command.
   dir_path = os.path.dirname(jsonlz4_path)
-  json_file = tempfile.NamedTemporaryFile(mode='w', dir=dir_path, suffix='.json', delete=False)
+  json_file = tempfile.NamedTemporaryFile(mode='wb', dir=dir_path, suffix='.json', delete=False)
   try:
-    json.dump(session, json_file)
+    json_file.write(dump_json(session))
     json_file.close()
     subprocess.check_call(['jsonlz4', json_file.name, jsonlz4_path])
   finally:
@@ -344,19 +413,19 @@ def format_contents(session, titles=False, urls=False, format='human', closed=Fa
     closed_windows = session.get('_closedWindows', [])
     window_lists.append(closed_windows)
     prefixes = ('W', 'Closed w')
+  # Make room for "Closed window" labels if there are any.
+  if closed:
+    format_window = '{:17s} {:3d} tabs'.format
+  else:
+    format_window = '{:8s} {:3d} tabs'.format
   tab_counts = []
   for window_list, prefix in zip(window_lists, prefixes):
     for w, window in enumerate(window_list):
-      label = prefix+'indow {:3s}'.format(str(w+1)+':')
-      if closed:
-        label_width = '17'
-      else:
-        label_width = '8'
-      format_str = '{:'+label_width+'s} {:3d} tabs'
+      label = f'{prefix}indow {str(w+1)+":":3s}'
       tabs = len(window['tabs'])
       tab_counts.append(tabs)
       if format == 'human':
-        output.append(format_str.format(label, tabs))
+        output.append(format_window(label, tabs))
       for tab in get_tabs(window):
         if not (titles or urls):
           continue
@@ -404,32 +473,35 @@ def find_profile(firefox_dir=DEFAULT_FIREFOX_DIR, profiles_ini_filename='profile
     fail(f'Error: Could not find profiles.ini file {str(profiles_ini)!r}')
   config = configparser.ConfigParser()
   config.read(profiles_ini)
-  default_section = find_section_by_install(config)
-  if default_section is None:
-    default_section = find_section_by_default(config)
+  default_section = find_default_section(config)
   if default_section is None:
     raise RuntimeError(f'Could not find the default profile in {str(firefox_dir)!r}')
   return get_profile_from_section(config, default_section, firefox_dir)
 
 
-def find_section_by_install(config):
+def find_default_section(config):
+  """Find the section for the default profile, in one pass through the config.
+  Prefer the profile named by the Install section's Default, and fall back to the profile marked
+  with Default=1."""
+  install_default = None
+  install_ok = True
+  sections_by_path = {}
+  default_section = None
   for section in config.sections():
+    values = config[section]
     if section.startswith('Install'):
-      if 'Default' in config[section]:
-        default = config[section].get('Default')
+      if 'Default' in values:
+        install_default = values.get('Default')
       else:
-        return None
-  for section in config.sections():
-    path = config[section].get('Path')
-    if path == default:
-      return section
-
-
-def find_section_by_default(config):
-  for section in config.sections():
-    default = config[section].get('Default')
-    if default == '1':
-      return section
+        install_ok = False
+    path = values.get('Path')
+    if path is not None:
+      sections_by_path.setdefault(path, section)
+    if default_section is None and values.get('Default') == '1':
+      default_section = section
+  if install_ok and install_default is not None and install_default in sections_by_path:
+    return sections_by_path[install_default]
+  return default_section
 
 
 def get_profile_from_section(config, section, firefox_dir):
@@ -3,11 +3,18 @@ import argparse
 import collections
 import logging
 import math
+import os
+import re
+import stat
 import sys
 from utillib import console
 assert sys.version_info.major >= 3, 'Python 3 required'
 
 DEFAULT_TRUNCATED_COLUMNS = (-1, 0)
+# Buffer size for output to a file or pipe (the default is only 8 KiB).
+OUTPUT_BUFFER_SIZE = 64*1024
+# Input files this big are read twice instead of being held in memory.
+STREAM_MIN_SIZE = 32*1024*1024
 DESCRIPTION = """Adjust column spacing to fit the width."""
 
 
@@ -36,7 +43,7 @@ def make_argparser():
          '("contains"), at the start of the field ("start"), or end ("end"). The second argument '
          'should be the string to match. There is also a 3-argument form, where the first argument '
          'is the column number, the second is the match type, and the third is the match string.')
-  parser.add_argument('-w', '--term-width', type=int, default=console.termwidth(),
+  parser.add_argument('-w', '--term-width', type=int,
     help='Force the script to think the terminal width is this, instead of auto-detecting it.')
   parser.add_argument('-l', '--log', type=argparse.FileType('w'), default=sys.stderr,
     help='Print log messages to this file instead of to stderr. Warning: Will overwrite the file.')
@@ -57,21 +64,46 @@ def main(argv):
 
   excludes = parse_excludes(args.exclude)
 
-  lines, max_width = parse_input(args.input)
-
   excludes_columned, excludes_uncolumned = collate_excludes(excludes)
-  lines = filter_lines(lines, excludes_columned, excludes_uncolumned)
 
-  max_widths = get_max_column_widths(lines, omit_cols=args.omit_cols)
+  # For big files, only gather the widths on the first pass, then go back and read the lines again
+  # while printing them.
+  if is_large_file(args.input):
+    start = args.input.tell()
+    excluded, max_width, max_widths = parse_input(
+      args.input, excludes_columned, excludes_uncolumned, omit_cols=args.omit_cols, stream=True
+    )
+    args.input.seek(start)
+    lines = reread_lines(args.input, excluded)
+  else:
+    lines, max_width, max_widths = parse_input(
+      args.input, excludes_columned, excludes_uncolumned, omit_cols=args.omit_cols
+    )
+
+  # Only detect the terminal width if it wasn't given.
+  if args.term_width is None:
+    term_width = console.termwidth()
+  else:
+    term_width = args.term_width
 
   if args.expand:
-    max_width = args.term_width
+    max_width = term_width
   else:
-    max_width = min(args.term_width, max_width)
+    max_width = min(term_width, max_width)
 
   widths = calculate_column_widths(max_width, max_widths, args.truncated_columns)
 
-  print_lines(lines, widths, omit_cols=args.omit_cols, trunc_from=args.trunc_from)
+  # When not writing to a terminal, use a bigger buffer so large tables take fewer write() calls.
+  if sys.stdout.isatty():
+    output = sys.stdout
+  else:
+    output = open(
+      sys.stdout.fileno(), 'w', buffering=OUTPUT_BUFFER_SIZE, encoding=sys.stdout.encoding,
+      errors=sys.stdout.errors, closefd=False
+    )
+
+  print_lines(lines, widths, omit_cols=args.omit_cols, trunc_from=args.trunc_from, output=output)
+  output.flush()
 
 
 def parse_excludes(exclude_list):
@@ -113,17 +145,26 @@ def collate_excludes(excludes):
       excludes_uncolumned[exclude['match']].add(exclude['string'])
     else:
       excludes_columned[exclude['column']][exclude['match']].add(exclude['string'])
-  return excludes_columned, excludes_uncolumned
+  excludes_columned = {
+    column:compile_queries(queries) for column, queries in excludes_columned.items()
+  }
+  return excludes_columned, compile_queries(excludes_uncolumned)
 
 
-def filter_lines(lines, excludes_columned, excludes_uncolumned):
-  filtered_lines = []
-  for i, line in enumerate(lines):
-    if filter_line(line, excludes_columned, excludes_uncolumned):
-      logging.info(f'Excluding line {i+1}..')
+def compile_queries(queries):
+  """Convert each set of strings to the form match_field() checks fastest: a tuple for "start" and
+  "end" (so str.startswith()/endswith() can check them all in one call) and a (regex, tuple) pair
+  for "contains"."""
+  compiled = {}
+  for match_type, strings in queries.items():
+    if match_type in ('start', 'end'):
+      compiled[match_type] = tuple(strings)
+    elif match_type == 'contains':
+      pattern = re.compile('|'.join(re.escape(string) for string in strings))
+      compiled[match_type] = (pattern, tuple(strings))
     else:
-      filtered_lines.append(line)
-  return filtered_lines
+      compiled[match_type] = strings
+  return compiled
 
 
 def filter_line(line, excludes_columned, excludes_uncolumned):
@@ -142,47 +183,94 @@ def match_field(value, queries):
         logging.debug(f'Field {value!r} matches "exact" filter.')
         return True
     elif match_type == 'contains':
-      for string in strings:
-        if string in value:
-          logging.debug(f'Field {value!r} matches "contains" filter {string!r}.')
-          return True
+      pattern, strings = strings
+      if pattern.search(value):
+        # Only now go through them one at a time, to find which one matched.
+        string = next(string for string in strings if string in value)
+        logging.debug(f'Field {value!r} matches "contains" filter {string!r}.')
+        return True
     elif match_type == 'start':
-      for string in strings:
-        if value.startswith(string):
-          logging.debug(f'Field {value!r} matches "start" filter {string!r}.')
-          return True
+      if value.startswith(strings):
+        string = next(string for string in strings if value.startswith(string))
+        logging.debug(f'Field {value!r} matches "start" filter {string!r}.')
+        return True
     elif match_type == 'end':
-      for string in strings:
-        if value.endswith(string):
-          logging.debug(f'Field {value!r} matches "end" filter {string!r}.')
-          return True
+      if value.endswith(strings):
+        string = next(string for string in strings if value.endswith(string))
+        logging.debug(f'Field {value!r} matches "end" filter {string!r}.')
+        return True
   return False
 
 
-def parse_input(input_file):
+def is_large_file(input_file):
+  """Return True if the input is a regular file of at least STREAM_MIN_SIZE bytes."""
+  try:
+    stats = os.fstat(input_file.fileno())
+  except (OSError, ValueError):
+    return False
+  return stat.S_ISREG(stats.st_mode) and stats.st_size >= STREAM_MIN_SIZE
+
+
+def parse_input(
+    input_file, excludes_columned, excludes_uncolumned, omit_cols=False, stream=False
+  ):
+  """Read the input, split it into fields, and drop excluded lines, all in one pass.
+  Returns the remaining lines, the width of the widest input line, and the width of the widest field
+  in each column of the remaining lines.
+  If `stream` is True, the input is read line by line and the lines aren't kept. The set of excluded
+  line numbers is returned in their place, for reread_lines()."""
   lines = []
+  excluded = set()
   max_width = 0
-  for line_raw in input_file:
-    line = line_raw.rstrip('\r\n')
-    max_width = max(len(line), max_width)
-    if line:
-      lines.append(line.split())
-  return lines, max_width
-
-
-def get_max_column_widths(lines, omit_cols=False):
   widths = []
   min_num_columns = 999999999
-  for line in lines:
+  line_num = 0
+  # Reading it all at once is faster than line by line. stdin doesn't translate newlines, so strip
+  # any '\r' left from CRLF line endings. (Unlike str.splitlines(), this won't split on other
+  # characters like \x0c.)
+  if stream:
+    line_strs = (line_str.rstrip('\r\n') for line_str in input_file)
+  else:
+    line_strs = (line_str.rstrip('\r') for line_str in input_file.read().split('\n'))
+  for line_str in line_strs:
+    max_width = max(len(line_str), max_width)
+    if not line_str:
+      continue
+    line = line_str.split()
+    line_num += 1
+    if filter_line(line, excludes_columned, excludes_uncolumned):
+      logging.info(f'Excluding line {line_num}..')
+      if stream:
+        excluded.add(line_num)
+      continue
+    if not stream:
+      lines.append(line)
     min_num_columns = min(len(line), min_num_columns)
     for i, field in enumerate(line):
-      if len(widths) <= i:
-        widths.append(len(field))
-      else:
-        widths[i] = max(len(field), widths[i])
+      width = len(field)
+      if i >= len(widths):
+        widths.append(width)
+      elif width > widths[i]:
+        widths[i] = width
   if omit_cols:
     widths = widths[:min_num_columns]
-  return widths
+  if stream:
+    return excluded, max_width, widths
+  return lines, max_width, widths
+
+
+def reread_lines(input_file, excluded):
+  """Read the input again after parse_input(stream=True), yielding the same lines it would have
+  returned. Lines are numbered the same way, so the `excluded` ones can be skipped without running
+  the filters again."""
+  line_num = 0
+  for line_str in input_file:
+    line_str = line_str.rstrip('\r\n')
+    if not line_str:
+      continue
+    line_num += 1
+    if line_num not in excluded:
+      yield line_str.split()
 
 
 def calculate_column_widths(max_width, max_widths, truncated_columns):
@@ -190,50 +278,69 @@ def calculate_column_widths(max_width, max_widths, truncated_columns):
   widths = [width+1 for width in max_widths]
   # But subtract 1 from the last column because we don't need a space there.
   widths[-1] -= 1
-  widths_total = sum(widths)
-  free_space = max_width - widths_total
+  free_space = max_width - sum(widths)
+  # Keep track of how much is left to remove or add instead of re-summing the widths each time.
   if free_space < 0:
-    remove_per_column = -free_space / len(truncated_columns)
+    excess = -free_space
+    remove_per_column = excess / len(truncated_columns)
     logging.debug(f'Removing {remove_per_column} from columns {truncated_columns}')
+    step = math.ceil(remove_per_column)
     for i in truncated_columns:
-      decrease = min(math.ceil(remove_per_column), sum(widths) - max_width)
+      decrease = min(step, excess)
       widths[i] -= decrease
-      if sum(widths) <= max_width:
+      excess -= decrease
+      if excess <= 0:
         break
   else:
-    free_space_per_column = free_space / (len(widths)-1)
-    for i, width in enumerate(widths[:-1]):
-      increase = min(math.ceil(free_space_per_column), max_width - sum(widths))
-      # print(f'Adding {increase} to {width} (column {i})')
+    step = math.ceil(free_space / (len(widths)-1))
+    for i in range(len(widths)-1):
+      increase = min(step, free_space)
       widths[i] += increase
-      if sum(widths) >= max_width:
+      free_space -= increase
+      if free_space <= 0:
         break
   logging.info(f'Calculated widths: {widths}')
   return widths
 
 
-def print_lines(lines, widths, omit_cols=True, trunc_from='end'):
+def print_lines(lines, widths, omit_cols=True, trunc_from='end', output=None):
+  if output is None:
+    output = sys.stdout
   logging.info(f'trunc_from: {trunc_from}')
+  from_start = trunc_from == 'start'
+  num_cols = len(widths)
+  # How many characters of each field to keep: all but one of the column width, to leave room for a
+  # space, unless it's the last field in the line.
+  keeps = [width-1 for width in widths]
+  write = output.write
   for line in lines:
-    for i, field in enumerate(line):
-      if omit_cols and i >= len(widths):
-        print()
+    if not line:
+      continue
+    last = len(line) - 1
+    if omit_cols and last >= num_cols:
+      # The line has extra columns, which are each replaced by a newline.
+      mid_fields = line[:num_cols]
+      ending = '\n' * (len(line) - num_cols)
+    else:
+      mid_fields = line[:last]
+      ending = None
+    if from_start:
+      parts = [
+        field[max(0, len(field)-keep):].ljust(width)
+        for field, keep, width in zip(mid_fields, keeps, widths)
+      ]
+    else:
+      parts = [field[:keep].ljust(width) for field, keep, width in zip(mid_fields, keeps, widths)]
+    if ending is None:
+      field = line[last]
+      width = widths[last]
+      if from_start:
+        ending = field[max(0, len(field)-width):] + '\n'
       else:
-        start = max(0, len(field)+1 - widths[i])
-        end = widths[i] - 1
-        if i+1 == len(line):
-          start = max(0, start-1)
-          end += 1
-        if trunc_from == 'start':
-          final_field = field[start:]
-        else:
-          final_field = field[:end]
-        spaces = widths[i] - len(final_field)
-        if i+1 == len(line):
-          ending = '\n'
-        else:
-          ending = ' ' * spaces
-        sys.stdout.write(final_field + ending)
+        ending = field[:width] + '\n'
+    parts.append(ending)
+    # Build the whole line and write it at once.
+    write(''.join(parts))
 
 
 def int_list(csv):
@@ -2,9 +2,27 @@
 import argparse
 import logging
 import sys
-import bs4
+try:
+  import lxml.etree
+  import lxml.html
+except ImportError:
+  lxml = None
+try:
+  import bs4
+except ImportError:
+  bs4 = None
 assert sys.version_info.major >= 3, 'Python 3 required'
 
+# An XPath test for whether an element has the given class (like a `.class` CSS selector).
+HAS_CLASS = "contains(concat(' ', normalize-space(@class), ' '), ' {} ')"
+# The same tables bs4 finds with the selector in parse_tlds_from_soup().
+if lxml is not None:
+  TABLE_XPATH = lxml.etree.XPath(
+    "//*[@id='content']//article[{}]/div[{}]/div[{}]/div[{} and {}]/table".format(
+      HAS_CLASS.format('node-16971'), HAS_CLASS.format('field-type-text-with-summary'),
+      HAS_CLASS.format('field-items'), HAS_CLASS.format('field-item'), HAS_CLASS.format('even')
+    )
+  )
 ICANN_URL = 'https://newgtlds.icann.org/en/program-status/delegated-strings'
 DESCRIPTION = "Parse the official ICANN list of new gTLDs from "+ICANN_URL+""" and print as a simple
 list, one per line."""
@@ -36,9 +54,17 @@ def main(argv):
 
   logging.basicConfig(stream=args.log, level=args.volume, format='%(message)s')
 
-  soup = bs4.BeautifulSoup(args.input, features='html5lib')
+  # lxml's C parser is much faster than html5lib, so only use BeautifulSoup if lxml isn't installed.
+  if lxml is not None:
+    root = lxml.html.document_fromstring(args.input.read())
+    tlds = parse_tlds_from_tree(root, idn=args.idn)
+  elif bs4 is not None:
+    soup = bs4.BeautifulSoup(args.input, features='html5lib')
+    tlds = parse_tlds_from_soup(soup, idn=args.idn)
+  else:
+    fail('Error: Either lxml or bs4 (BeautifulSoup) must be installed.')
 
-  for tld in parse_tlds_from_soup(soup, idn=args.idn):
+  for tld in tlds:
     if args.lower:
       print(tld.lower())
     else:
@@ -52,10 +78,11 @@ def parse_tlds_from_soup(soup, idn=False):
     logging.error('Error: HTML structure not as expected.')
     return False
   table = elements[0]
-  for row in table.children:
-    if not (isinstance(row, bs4.element.Tag) and row.name == 'tr'):
+  Tag = bs4.element.Tag
+  for row in table.contents:
+    if not (isinstance(row, Tag) and row.name == 'tr'):
       continue
-    cells = [cell for cell in row.children if isinstance(cell, bs4.element.Tag) and cell.name == 'td']
+    cells = [cell for cell in row.contents if isinstance(cell, Tag) and cell.name == 'td']
     if len(cells) != 2:
       continue
     tld = parse_tld_cell(cells[1], idn=idn)
@@ -63,33 +90,95 @@ def parse_tlds_from_soup(soup, idn=False):
       yield tld
 
 
+def parse_tlds_from_tree(root, idn=False):
+  """Like parse_tlds_from_soup(), but for an lxml tree."""
+  # html5lib adds the implied <tbody> to tables, but libxml2 doesn't.
+  bodies = []
+  for table in TABLE_XPATH(root):
+    bodies.extend(table.findall('tbody') or [table])
+  if len(bodies) != 1:
+    logging.error('Error: HTML structure not as expected.')
+    return False
+  for row in bodies[0]:
+    if row.tag != 'tr':
+      continue
+    cells = [cell for cell in row if cell.tag == 'td']
+    if len(cells) != 2:
+      continue
+    tld = parse_tld_element(cells[1], idn=idn)
+    if tld is not None:
+      yield tld
+
+
+def parse_tld_element(cell, idn=False):
+  """Like parse_tld_cell(), but for an lxml element."""
+  children = get_child_nodes(cell)
+  if len(children) == 1:
+    return parse_tld_string(get_node_string(cell), idn=idn)
+  cell_str = lxml.html.tostring(cell, encoding='unicode', with_tail=False)
+  if len(children) == 2:
+    first, second = children
+    if not isinstance(first, str) and first.tag == 'span' and first.get('dir') == 'rtl':
+      return parse_rtl_tld(get_node_string(first), get_node_string(second), cell_str, idn=idn)
+  logging.warning('Warning: Unexpected TLD element structure (issue 4): {}'.format(cell_str))
+  return None
+
+
+def get_child_nodes(element):
+  """Get the child elements and text of an lxml element, in order (like bs4's `children`)."""
+  children = []
+  if element.text:
+    children.append(element.text)
+  for child in element:
+    children.append(child)
+    if child.tail:
+      children.append(child.tail)
+  return children
+
+
+def get_node_string(node):
+  """Get the text of a child node from get_child_nodes(), if it's a string or an element with only
+  one string inside it (like bs4's `string`)."""
+  if isinstance(node, str):
+    return node
+  children = get_child_nodes(node)
+  if len(children) != 1:
+    return None
+  return get_node_string(children[0])
+
+
 def parse_tld_cell(cell, idn=False):
-  children = list(cell.children)
+  # `contents` is the list `children` iterates over, so use it directly instead of copying it.
+  # (And `string` is always None when there's more than one child, so there's no need to check it.)
+  children = cell.contents
   if len(children) == 1:
     return parse_tld_string(cell.string, idn=idn)
-  elif cell.string is None:
-    if len(children) == 2 and children[0].name == 'span' and children[0].attrs['dir'] == 'rtl':
-      fields = children[1].string.split()
-      if len(fields) != 5:
-        logging.warning('Warning: Unexpected TLD element structure (issue 1): {}'.format(cell))
-        return None
-      elif not fields[0].startswith('(xn--'):
-        logging.warning('Warning: Unexpected TLD element structure (issue 2): {}'.format(cell))
-        return None
-      elif not fields[0].endswith(')'):
-        logging.warning('Warning: Unexpected TLD element structure (issue 3): {}'.format(cell))
-        return None
-      logging.info('Info: Child element found inside TLD element: {}'.format(cell))
-      if idn:
-        return fields[0][1:-1]
-      else:
-        return children[0].string
-    else:
-      logging.warning('Warning: Unexpected TLD element structure (issue 4): {}'.format(cell))
-      return None
-  else:
-    logging.warning('Warning: Unexpected TLD element structure (issue 5): {}'.format(cell))
+  if len(children) == 2:
+    first, second = children
+    if first.name == 'span' and first.attrs['dir'] == 'rtl':
+      return parse_rtl_tld(first.string, second.string, cell, idn=idn)
+  logging.warning('Warning: Unexpected TLD element structure (issue 4): {}'.format(cell))
+  return None
+
+
+def parse_rtl_tld(tld, rest, cell, idn=False):
+  """Parse a cell with a right-to-left TLD in its own <span>, followed by `rest`, which should be
+  like " (xn--ngbc5azd) – Arabic for "web/network"". `cell` is only used in log messages."""
+  fields = rest.split()
+  if len(fields) != 5:
+    logging.warning('Warning: Unexpected TLD element structure (issue 1): {}'.format(cell))
     return None
+  elif not fields[0].startswith('(xn--'):
+    logging.warning('Warning: Unexpected TLD element structure (issue 2): {}'.format(cell))
+    return None
+  elif not fields[0].endswith(')'):
+    logging.warning('Warning: Unexpected TLD element structure (issue 3): {}'.format(cell))
+    return None
+  logging.info('Info: Child element found inside TLD element: {}'.format(cell))
+  if idn:
+    return fields[0][1:-1]
+  else:
+    return tld
 
 
 def parse_tld_string(tld_raw, idn=False):